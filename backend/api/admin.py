@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Message
+from .models import LLMJob, Message
 
 
 @admin.register(Message)
@@ -7,4 +7,11 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ['id', 'content', 'created_at']
     list_filter = ['created_at']
     search_fields = ['content']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['created_at']
+
+@admin.register(LLMJob)
+class LLMJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'priority', 'fingerprint', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'priority', 'created_at']
+    search_fields = ['fingerprint', 'prompt']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
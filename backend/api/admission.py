@@ -0,0 +1,168 @@
+"""
+Shared admission state for AdmissionControlMiddleware.
+
+Token buckets and in-flight tickets live in Postgres so that every
+gunicorn worker sees the same quotas.
+"""
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import AdmissionTicket, ClientQuota, EndpointSlot
+
+# When this process last pruned idle buckets (see prune_idle_quotas)
+_last_prune = 0
+
+
+def take_token(client_key, endpoint_class, rate, burst, max_wait=0, cost=1):
+    """
+    Take `cost` tokens from the client's bucket.
+
+    Returns 0 when the tokens were available. If they are due within
+    `max_wait` seconds they are reserved and the wait is returned; the caller
+    must sleep that long before proceeding. Otherwise nothing is taken and
+    the (larger) wait is returned so the caller can reject the request.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        bucket, created = ClientQuota.objects.select_for_update().get_or_create(
+            client_key=client_key,
+            endpoint_class=endpoint_class,
+            defaults={'tokens': burst, 'updated_at': now},
+        )
+        if not created:
+            elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+            bucket.tokens = min(burst, bucket.tokens + elapsed * rate)
+            bucket.updated_at = now
+
+        retry_after = max((cost - bucket.tokens) / rate, 0)
+        if retry_after <= max_wait:
+            # A reservation can leave the bucket negative, pushing back later callers
+            bucket.tokens -= cost
+
+        bucket.save(update_fields=['tokens', 'updated_at'])
+        return retry_after
+
+
+def prune_idle_quotas():
+    """
+    Delete buckets idle long enough to have refilled to their burst. A new
+    bucket starts full, so dropping them changes nothing for the client.
+    """
+    now = timezone.now()
+    deleted = 0
+    for endpoint_class, config in settings.ADMISSION_ENDPOINT_CLASSES.items():
+        # Twice the time to fill an empty bucket, since reservations can leave
+        # it down to -cost (and cost never exceeds burst)
+        refill_seconds = 2 * config['burst'] / config['rate']
+        deleted += ClientQuota.objects.filter(
+            endpoint_class=endpoint_class,
+            updated_at__lt=now - timedelta(seconds=refill_seconds),
+        ).delete()[0]
+    return deleted
+
+
+def _maybe_prune_idle_quotas():
+    global _last_prune
+    if time.monotonic() - _last_prune < settings.ADMISSION_QUOTA_PRUNE_SECONDS:
+        return
+    _last_prune = time.monotonic()
+    prune_idle_quotas()
+
+
+def acquire_slot(endpoint_class, limit, client_key='', client_limit=None):
+    """
+    Admit a request if fewer than `limit` are in flight for the class and,
+    when `client_limit` is given, fewer than `client_limit` for this client.
+    Returns a tuple of (ticket, full) where ticket is passed to release_slot,
+    or is None and full says which cap was hit: 'client' or 'class'.
+    Tickets older than ADMISSION_TICKET_STALE_SECONDS are treated as leaked.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.ADMISSION_TICKET_STALE_SECONDS)
+    slot, _ = EndpointSlot.objects.get_or_create(endpoint_class=endpoint_class)
+
+    with transaction.atomic():
+        # Serialise admissions for this class on its slot row
+        slot = EndpointSlot.objects.select_for_update().get(pk=slot.pk)
+        slot.tickets.filter(created_at__lt=stale_before).delete()
+        if client_limit is not None and slot.tickets.filter(client_key=client_key).count() >= client_limit:
+            return None, 'client'
+        if slot.tickets.count() >= limit:
+            return None, 'class'
+        return AdmissionTicket.objects.create(slot=slot, client_key=client_key), None
+
+
+def release_slot(ticket):
+    AdmissionTicket.objects.filter(pk=ticket.pk).delete()
+
+
+def admit(client_key, endpoint_class, cost=1):
+    """
+    Admit one request for the endpoint class configured in ADMISSION_ENDPOINT_CLASSES.
+
+    `cost` is the number of tokens the request uses up.
+    Returns a tuple of (ticket, rejection_response). The concurrency slot is
+    taken first and never waited for, so a request only ever holds a worker
+    while it counts against the cap. A client may hold at most
+    ADMISSION_MAX_IN_FLIGHT_PER_CLIENT of the class's slots, so it can't lock
+    others out. A client whose next token is due within
+    ADMISSION_MAX_QUEUE_SECONDS waits for it; otherwise the request is rejected.
+    """
+    config = settings.ADMISSION_ENDPOINT_CLASSES[endpoint_class]
+    _maybe_prune_idle_quotas()
+
+    ticket, full = acquire_slot(
+        endpoint_class, config['concurrency'],
+        client_key=client_key, client_limit=settings.ADMISSION_MAX_IN_FLIGHT_PER_CLIENT
+    )
+    if full == 'client':
+        return None, reject_response(
+            f"Too many of your {endpoint_class} requests are in flight. Please wait for them to finish.",
+            429, settings.ADMISSION_RETRY_AFTER_SECONDS
+        )
+    if ticket is None:
+        return None, reject_response(
+            f"Too many concurrent {endpoint_class} requests. Please retry shortly.",
+            503, settings.ADMISSION_RETRY_AFTER_SECONDS
+        )
+
+    try:
+        retry_after = take_token(
+            client_key, endpoint_class, config['rate'], config['burst'],
+            max_wait=settings.ADMISSION_MAX_QUEUE_SECONDS, cost=cost
+        )
+    except Exception:
+        release_slot(ticket)
+        raise
+
+    if retry_after > settings.ADMISSION_MAX_QUEUE_SECONDS:
+        release_slot(ticket)
+        return None, reject_response(
+            f"Rate limit exceeded for {endpoint_class} requests. Please slow down.",
+            429, retry_after
+        )
+
+    if retry_after:
+        # Our token is reserved; wait until it is due
+        time.sleep(retry_after)
+
+    return ticket, None
+
+
+def client_key(request):
+    if settings.ADMISSION_TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return forwarded.split(',')[0].strip()[:64]
+    return request.META.get('REMOTE_ADDR', 'unknown')[:64]
+
+
+def reject_response(message, status, retry_after):
+    response = JsonResponse({"error": message}, status=status)
+    response['Retry-After'] = str(max(math.ceil(retry_after), 1))
+    return response
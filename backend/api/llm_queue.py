@@ -0,0 +1,282 @@
+"""
+Postgres-backed job queue for Gemini requests.
+
+Views submit jobs and return immediately with a job id to poll, while the
+run_llm_workers management command claims pending jobs and calls Gemini outside the request cycle.
+Jobs that are pending together are packed into one Gemini call as a batch.
+"""
+import hashlib
+import json
+import os
+from datetime import timedelta
+
+import google.generativeai as genai
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import LLMJob
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+
+class GeminiNotConfigured(Exception):
+    pass
+
+
+def build_concise_prompt(location_context):
+    """
+    Build the short prompt that is actually sent to Gemini
+    """
+    area = rounded_area(location_context.get('area_km2'))
+    area_str = f"{area:,.0f}" if area >= 1 else f"{area:g}"
+
+    return f"""Location: {location_context['location_name']}
+Area: ~{area_str} km²
+
+Give me exactly 2-3 bullet points for each:
+
+**Historical Events:**
+(Most significant events with dates)
+
+**Landmarks:**
+(Famous places or monuments)
+
+**Notable Facts:**
+(Interesting tidbits about this area)
+
+Keep each bullet point to 1 short sentence. Be very concise."""
+
+
+def build_batch_prompt(jobs):
+    """
+    Pack several region prompts into one request that answers with JSON
+    keyed by job id
+    """
+    prompt = """Answer each of the following independent location requests.
+
+Respond with a single JSON object that maps each request id (as a string) to its
+answer, written as a Markdown string in exactly the format that request asks for.
+Include every request id and nothing else."""
+
+    for job in jobs:
+        prompt += f"""
+
+=== Request id: {job.pk} ===
+{job.prompt}"""
+
+    return prompt
+
+
+def parse_batch_response(text):
+    """
+    Parse the JSON object returned for a batch prompt into {job_id: answer}
+    """
+    text = text.strip()
+    # Tolerate a Markdown code fence around the JSON
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("Batch response is not a JSON object")
+
+    return {str(key): value for key, value in data.items() if isinstance(value, str) and value.strip()}
+
+
+def rounded_area(area_km2):
+    """
+    Round a viewport area to one significant figure, so views of the same
+    place at nearby zoom levels share a prompt (and a queued job)
+    """
+    if not area_km2 or area_km2 <= 0:
+        return 0
+    return float(f"{area_km2:.1g}")
+
+
+def region_fingerprint(location_context):
+    """
+    Jobs for the same resolved place at a similar area share a fingerprint
+    """
+    key = f"{GEMINI_MODEL}\n{location_context['location_name']}\n{rounded_area(location_context.get('area_km2'))}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def call_gemini(prompt, json_output=False):
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        raise GeminiNotConfigured(
+            "Gemini API key not configured. Please set GEMINI_API_KEY environment variable."
+        )
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    request_options = {"timeout": settings.LLM_GEMINI_TIMEOUT_SECONDS}
+    if json_output:
+        return model.generate_content(
+            prompt,
+            generation_config={"response_mime_type": "application/json"},
+            request_options=request_options,
+        ).text
+    return model.generate_content(prompt, request_options=request_options).text
+
+
+def submit_job(prompt, location_context, priority=LLMJob.PRIORITY_INTERACTIVE):
+    """
+    Queue a Gemini request, reusing an in-flight or recently finished job
+    for the same fingerprint instead of creating a duplicate.
+    """
+    fingerprint = region_fingerprint(location_context)
+    fresh_since = timezone.now() - timedelta(seconds=settings.LLM_JOB_RESULT_TTL_SECONDS)
+
+    for _ in range(2):
+        with transaction.atomic():
+            existing = (
+                LLMJob.objects.select_for_update()
+                .filter(fingerprint=fingerprint)
+                .filter(
+                    Q(status__in=LLMJob.ACTIVE_STATUSES)
+                    | Q(status=LLMJob.STATUS_DONE, finished_at__gte=fresh_since)
+                )
+                .order_by('-created_at')
+                .first()
+            )
+            if existing:
+                # An interactive request bumps a queued pre-warm job
+                if existing.status == LLMJob.STATUS_PENDING and priority < existing.priority:
+                    existing.priority = priority
+                    existing.save(update_fields=['priority'])
+                return existing
+
+            try:
+                with transaction.atomic():
+                    return LLMJob.objects.create(
+                        fingerprint=fingerprint,
+                        prompt=prompt,
+                        location_context=location_context,
+                        priority=priority,
+                    )
+            except IntegrityError:
+                # Another request queued the same fingerprint concurrently; pick it up
+                continue
+
+    return LLMJob.objects.filter(fingerprint=fingerprint).order_by('-created_at').first()
+
+
+def claim_batch(max_size, window):
+    """
+    Atomically take up to max_size pending jobs, highest priority first.
+    SKIP LOCKED lets several workers poll the table without blocking each other.
+
+    A batch only holds jobs of the same priority as the first one, so pre-warm
+    jobs never share (and slow down) a call made for an interactive request.
+
+    While the batch is not full, jobs younger than `window` seconds are left
+    queued (an empty list is returned) so that requests arriving close
+    together can share one Gemini call.
+    """
+    with transaction.atomic():
+        pending = (
+            LLMJob.objects.select_for_update(skip_locked=True)
+            .filter(status=LLMJob.STATUS_PENDING)
+            .order_by('priority', 'created_at')
+        )
+        first = pending.first()
+        if not first:
+            return []
+
+        jobs = list(pending.filter(priority=first.priority)[:max_size])
+
+        now = timezone.now()
+        oldest = min(job.created_at for job in jobs)
+        if len(jobs) < max_size and (now - oldest).total_seconds() < window:
+            return []
+
+        for job in jobs:
+            job.status = LLMJob.STATUS_RUNNING
+            job.started_at = now
+            job.attempts += 1
+        LLMJob.objects.bulk_update(jobs, ['status', 'started_at', 'attempts'])
+        return jobs
+
+
+def run_job(job):
+    try:
+        _finish_job(job, result=call_gemini(job.prompt))
+    except Exception as e:
+        _finish_job(job, error=f"Failed to get response from Gemini: {str(e)}")
+    return job
+
+
+def run_batch(jobs):
+    """
+    Answer several jobs with one Gemini call and fan the answers back out.
+    Jobs missing from the response go back to the queue for a later batch
+    (or a call of their own if nothing else is pending), up to LLM_JOB_MAX_ATTEMPTS.
+    """
+    if len(jobs) == 1:
+        return [run_job(jobs[0])]
+
+    try:
+        answers = parse_batch_response(call_gemini(build_batch_prompt(jobs), json_output=True))
+    except ValueError:
+        # Malformed JSON; retry every job
+        answers = {}
+    except Exception as e:
+        for job in jobs:
+            _finish_job(job, error=f"Failed to get response from Gemini: {str(e)}")
+        return jobs
+
+    for job in jobs:
+        answer = answers.get(str(job.pk))
+        if answer is not None:
+            _finish_job(job, result=answer)
+        elif job.attempts < settings.LLM_JOB_MAX_ATTEMPTS:
+            _requeue_job(job)
+        else:
+            _finish_job(job, error=f"No answer from Gemini after {job.attempts} attempts")
+    return jobs
+
+
+def _requeue_job(job):
+    job.status = LLMJob.STATUS_PENDING
+    _save_claimed_job(job, status=job.status, started_at=None)
+    job.started_at = None
+
+
+def _finish_job(job, result='', error=''):
+    job.result = result
+    job.error = error
+    job.status = LLMJob.STATUS_FAILED if error else LLMJob.STATUS_DONE
+    job.finished_at = timezone.now()
+    _save_claimed_job(job, result=job.result, error=job.error, status=job.status, finished_at=job.finished_at)
+
+
+def _save_claimed_job(job, **fields):
+    """
+    Write fields only while this worker still owns the job. If the job went
+    stale and was requeued, another worker's claim wins and this write is dropped.
+    """
+    return LLMJob.objects.filter(
+        pk=job.pk, status=LLMJob.STATUS_RUNNING, started_at=job.started_at
+    ).update(**fields)
+
+
+def requeue_stale_jobs():
+    """
+    Put jobs back in the queue if their worker died mid-request,
+    failing those that have used up LLM_JOB_MAX_ATTEMPTS
+    """
+    now = timezone.now()
+    stale = LLMJob.objects.filter(
+        status=LLMJob.STATUS_RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.LLM_JOB_STALE_SECONDS)
+    )
+    stale.filter(attempts__gte=settings.LLM_JOB_MAX_ATTEMPTS).update(
+        status=LLMJob.STATUS_FAILED,
+        error="Gemini request did not finish; giving up",
+        finished_at=now
+    )
+    return stale.update(status=LLMJob.STATUS_PENDING, started_at=None)
+
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+
+from api import llm_queue
+
+
+class Command(BaseCommand):
+    help = "Process queued Gemini jobs in batches with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.LLM_WORKER_COUNT,
+            help="Number of worker threads (default: LLM_WORKER_COUNT)",
+        )
+
+    def handle(self, *args, **options):
+        worker_count = max(options['workers'], 1)
+        stop = threading.Event()
+
+        # The web container applies migrations on startup; don't race it
+        self._wait_for_migrations()
+        self._requeue_stale_jobs()
+
+        threads = [
+            threading.Thread(target=self._work, args=(stop,), name=f"llm-worker-{i}", daemon=True)
+            for i in range(worker_count)
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {worker_count} LLM worker(s)"))
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(settings.LLM_JOB_STALE_SECONDS)
+                self._requeue_stale_jobs()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping LLM workers...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _wait_for_migrations(self):
+        while True:
+            try:
+                executor = MigrationExecutor(connection)
+                if not executor.migration_plan(executor.loader.graph.leaf_nodes()):
+                    return
+                self.stdout.write("Waiting for migrations to be applied...")
+            except DatabaseError as e:
+                self.stdout.write(f"Waiting for database: {e}")
+            connection.close()
+            time.sleep(settings.LLM_WORKER_RETRY_SECONDS)
+
+    def _requeue_stale_jobs(self):
+        try:
+            requeued = llm_queue.requeue_stale_jobs()
+        except Exception as e:
+            self.stderr.write(f"Failed to requeue stale jobs: {e}")
+            connection.close()
+            return
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+    def _work(self, stop):
+        # Each thread keeps one connection open for its lifetime; it is only
+        # dropped (and reopened on next use) after an error
+        try:
+            while not stop.is_set():
+                try:
+                    jobs = llm_queue.claim_batch(settings.LLM_BATCH_SIZE, settings.LLM_BATCH_WINDOW_SECONDS)
+                    if not jobs:
+                        stop.wait(settings.LLM_JOB_POLL_INTERVAL)
+                        continue
+                    for job in llm_queue.run_batch(jobs):
+                        self.stdout.write(f"Job {job.pk} finished: {job.status}")
+                except Exception as e:
+                    # Keep the thread alive; claimed jobs are requeued once they go stale
+                    self.stderr.write(f"LLM worker error: {e}")
+                    connection.close()
+                    stop.wait(settings.LLM_WORKER_RETRY_SECONDS)
+        finally:
+            connection.close()
@@ -0,0 +1,41 @@
+from django.conf import settings
+
+from . import admission
+
+
+class AdmissionControlMiddleware:
+    """
+    Per-client rate limits and per-endpoint-class concurrency caps for the
+    expensive API endpoints configured in ADMISSION_ENDPOINT_CLASSES.
+
+    Requests over a cap are rejected right away with a Retry-After header
+    (429 when the client is over quota, 503 when the endpoint class is busy)
+    rather than holding a worker while they wait.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Fast path: health checks and unlisted endpoints never touch the database
+        if not settings.ADMISSION_CONTROL_ENABLED or request.path in settings.ADMISSION_FAST_PATHS:
+            return self.get_response(request)
+
+        endpoint_class = self._classify(request.path)
+        if endpoint_class is None:
+            return self.get_response(request)
+
+        ticket, rejection = admission.admit(admission.client_key(request), endpoint_class)
+        if rejection:
+            return rejection
+
+        try:
+            return self.get_response(request)
+        finally:
+            admission.release_slot(ticket)
+
+    def _classify(self, path):
+        for endpoint_class, config in settings.ADMISSION_ENDPOINT_CLASSES.items():
+            if any(path.startswith(prefix) for prefix in config['paths']):
+                return endpoint_class
+        return None
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_llmjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdmissionTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClientQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_key', models.CharField(max_length=64)),
+                ('endpoint_class', models.CharField(max_length=32)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EndpointSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint_class', models.CharField(max_length=32, unique=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='clientquota',
+            constraint=models.UniqueConstraint(fields=('client_key', 'endpoint_class'), name='unique_client_quota'),
+        ),
+        migrations.AddField(
+            model_name='admissionticket',
+            name='slot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tickets', to='api.endpointslot'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_admission_control'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='admissionticket',
+            name='client_key',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_admissionticket_client_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clientquota',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
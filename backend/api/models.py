@@ -9,4 +9,88 @@ class Message(models.Model):
         return f"Message: {self.content[:50]}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+class LLMJob(models.Model):
+    """A queued Gemini request, processed by the run_llm_workers command."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_PENDING, STATUS_RUNNING]
+    FINISHED_STATUSES = [STATUS_DONE, STATUS_FAILED]
+
+    # Lower value is picked up first
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_PREWARM = 10
+
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    prompt = models.TextField()
+    location_context = models.JSONField(default=dict)
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_INTERACTIVE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"LLMJob {self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['priority', 'created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'created_at']),
+        ]
+        constraints = [
+            # At most one in-flight job per region fingerprint
+            models.UniqueConstraint(
+                fields=['fingerprint'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_llm_job_fingerprint',
+            ),
+        ]
+
+
+class ClientQuota(models.Model):
+    """Token bucket for one client on one endpoint class (see AdmissionControlMiddleware)."""
+
+    client_key = models.CharField(max_length=64)
+    endpoint_class = models.CharField(max_length=32)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.client_key} @ {self.endpoint_class}: {self.tokens:.1f}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['client_key', 'endpoint_class'], name='unique_client_quota'),
+        ]
+
+
+class EndpointSlot(models.Model):
+    """Lock row for an endpoint class; its tickets are the requests currently in flight."""
+
+    endpoint_class = models.CharField(max_length=32, unique=True)
+
+    def __str__(self):
+        return self.endpoint_class
+
+
+class AdmissionTicket(models.Model):
+    slot = models.ForeignKey(EndpointSlot, on_delete=models.CASCADE, related_name='tickets')
+    client_key = models.CharField(max_length=64, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Ticket {self.pk} for {self.slot}"
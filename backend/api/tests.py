@@ -0,0 +1,426 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .admission import acquire_slot, take_token
+from .llm_queue import claim_batch, parse_batch_response, requeue_stale_jobs, run_batch, submit_job
+from .middleware import AdmissionControlMiddleware
+from .models import AdmissionTicket, ClientQuota, LLMJob
+from .views import _llm_job_payload, _region_token, _unchanged_region_response, _viewport_summary
+
+
+class ParseBatchResponseTests(SimpleTestCase):
+    def test_plain_json(self):
+        answers = parse_batch_response('{"1": "first", "2": "second"}')
+        self.assertEqual(answers, {"1": "first", "2": "second"})
+
+    def test_fenced_json(self):
+        answers = parse_batch_response('```json\n{"7": "answer"}\n```')
+        self.assertEqual(answers, {"7": "answer"})
+
+    def test_keys_are_strings(self):
+        self.assertEqual(parse_batch_response('{"3": "x"}').keys(), {"3"})
+
+    def test_non_object_reply_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_batch_response('["first", "second"]')
+
+    def test_invalid_json_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_batch_response('Here are your answers: ...')
+
+    def test_non_string_and_blank_answers_are_dropped(self):
+        answers = parse_batch_response('{"1": "ok", "2": {"text": "nested"}, "3": null, "4": "  "}')
+        self.assertEqual(answers, {"1": "ok"})
+
+
+def location(name, area_km2=100):
+    return {"location_name": name, "area_km2": area_km2}
+
+
+class SubmitJobTests(TestCase):
+    def test_same_place_at_similar_area_shares_a_job(self):
+        job = submit_job("prompt", location("Paris", 100))
+
+        self.assertEqual(submit_job("other prompt", location("Paris", 120)).pk, job.pk)
+        self.assertNotEqual(submit_job("prompt", location("Paris", 500)).pk, job.pk)
+        self.assertNotEqual(submit_job("prompt", location("Lyon", 100)).pk, job.pk)
+
+    def test_finished_job_is_reused_until_it_expires(self):
+        job = submit_job("prompt", location("Paris"))
+        LLMJob.objects.filter(pk=job.pk).update(status=LLMJob.STATUS_DONE, finished_at=timezone.now())
+
+        self.assertEqual(submit_job("prompt", location("Paris")).pk, job.pk)
+
+        LLMJob.objects.filter(pk=job.pk).update(finished_at=timezone.now() - timedelta(days=1))
+        self.assertNotEqual(submit_job("prompt", location("Paris")).pk, job.pk)
+
+    def test_failed_job_is_not_reused(self):
+        job = submit_job("prompt", location("Paris"))
+        LLMJob.objects.filter(pk=job.pk).update(status=LLMJob.STATUS_FAILED, finished_at=timezone.now())
+
+        self.assertNotEqual(submit_job("prompt", location("Paris")).pk, job.pk)
+
+    def test_interactive_request_bumps_queued_prewarm_job(self):
+        job = submit_job("prompt", location("Paris"), LLMJob.PRIORITY_PREWARM)
+
+        submit_job("prompt", location("Paris"), LLMJob.PRIORITY_INTERACTIVE)
+
+        job.refresh_from_db()
+        self.assertEqual(job.priority, LLMJob.PRIORITY_INTERACTIVE)
+
+    def test_prewarm_request_does_not_lower_priority(self):
+        job = submit_job("prompt", location("Paris"), LLMJob.PRIORITY_INTERACTIVE)
+
+        submit_job("prompt", location("Paris"), LLMJob.PRIORITY_PREWARM)
+
+        job.refresh_from_db()
+        self.assertEqual(job.priority, LLMJob.PRIORITY_INTERACTIVE)
+
+
+class ClaimBatchTests(TestCase):
+    def submit(self, name, priority=LLMJob.PRIORITY_INTERACTIVE, age=60):
+        job = submit_job("prompt", location(name), priority)
+        LLMJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(seconds=age))
+        return job
+
+    def test_claims_oldest_first_and_marks_running(self):
+        second = self.submit("Lyon", age=10)
+        first = self.submit("Paris", age=20)
+
+        jobs = claim_batch(max_size=8, window=0)
+
+        self.assertEqual([job.pk for job in jobs], [first.pk, second.pk])
+        for job in LLMJob.objects.all():
+            self.assertEqual(job.status, LLMJob.STATUS_RUNNING)
+            self.assertEqual(job.attempts, 1)
+            self.assertIsNotNone(job.started_at)
+
+    def test_respects_max_size(self):
+        for name in ("Paris", "Lyon", "Nice"):
+            self.submit(name)
+
+        self.assertEqual(len(claim_batch(max_size=2, window=0)), 2)
+        self.assertEqual(len(claim_batch(max_size=2, window=0)), 1)
+        self.assertEqual(claim_batch(max_size=2, window=0), [])
+
+    def test_partial_batch_waits_for_window(self):
+        self.submit("Paris", age=0)
+
+        self.assertEqual(claim_batch(max_size=8, window=60), [])
+        self.assertEqual(LLMJob.objects.get().status, LLMJob.STATUS_PENDING)
+
+        self.assertEqual(len(claim_batch(max_size=8, window=0)), 1)
+
+    def test_full_batch_skips_window(self):
+        self.submit("Paris", age=0)
+        self.submit("Lyon", age=0)
+
+        self.assertEqual(len(claim_batch(max_size=2, window=60)), 2)
+
+    def test_batch_holds_a_single_priority(self):
+        prewarm = self.submit("Paris", LLMJob.PRIORITY_PREWARM, age=30)
+        interactive = self.submit("Lyon", age=10)
+
+        self.assertEqual([job.pk for job in claim_batch(max_size=8, window=0)], [interactive.pk])
+        self.assertEqual([job.pk for job in claim_batch(max_size=8, window=0)], [prewarm.pk])
+
+
+@override_settings(LLM_JOB_STALE_SECONDS=120, LLM_JOB_MAX_ATTEMPTS=3)
+class RequeueStaleJobsTests(TestCase):
+    def running(self, name, started_ago, attempts):
+        job = submit_job("prompt", location(name))
+        LLMJob.objects.filter(pk=job.pk).update(
+            status=LLMJob.STATUS_RUNNING,
+            started_at=timezone.now() - timedelta(seconds=started_ago),
+            attempts=attempts,
+        )
+        return job
+
+    def test_stale_job_goes_back_to_queue(self):
+        job = self.running("Paris", started_ago=300, attempts=1)
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, LLMJob.STATUS_PENDING)
+        self.assertIsNone(job.started_at)
+
+    def test_stale_job_at_max_attempts_fails(self):
+        job = self.running("Paris", started_ago=300, attempts=3)
+
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, LLMJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_recent_job_is_left_running(self):
+        job = self.running("Paris", started_ago=10, attempts=1)
+
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, LLMJob.STATUS_RUNNING)
+
+
+@override_settings(LLM_JOB_MAX_ATTEMPTS=2)
+class RunBatchTests(TestCase):
+    def claim(self, *names):
+        for name in names:
+            submit_job("prompt", location(name))
+        return claim_batch(max_size=8, window=0)
+
+    def test_answers_fan_out_and_missing_jobs_are_requeued(self):
+        paris, lyon = self.claim("Paris", "Lyon")
+
+        with mock.patch('api.llm_queue.call_gemini', return_value=f'{{"{paris.pk}": "answer"}}'):
+            run_batch([paris, lyon])
+
+        paris.refresh_from_db()
+        lyon.refresh_from_db()
+        self.assertEqual((paris.status, paris.result), (LLMJob.STATUS_DONE, "answer"))
+        self.assertEqual(lyon.status, LLMJob.STATUS_PENDING)
+
+    def test_missing_job_fails_after_max_attempts(self):
+        jobs = self.claim("Paris", "Lyon")
+        LLMJob.objects.update(attempts=2)
+        for job in jobs:
+            job.attempts = 2
+
+        with mock.patch('api.llm_queue.call_gemini', return_value='{}'):
+            run_batch(jobs)
+
+        self.assertEqual(set(LLMJob.objects.values_list('status', flat=True)), {LLMJob.STATUS_FAILED})
+
+    def test_reclaimed_job_is_not_overwritten(self):
+        paris, lyon = self.claim("Paris", "Lyon")
+        # The job went stale and another worker claimed it meanwhile
+        LLMJob.objects.filter(pk=paris.pk).update(started_at=timezone.now() + timedelta(seconds=1))
+
+        with mock.patch('api.llm_queue.call_gemini', return_value=f'{{"{paris.pk}": "late", "{lyon.pk}": "ok"}}'):
+            run_batch([paris, lyon])
+
+        paris.refresh_from_db()
+        lyon.refresh_from_db()
+        self.assertEqual(paris.status, LLMJob.STATUS_RUNNING)
+        self.assertEqual(lyon.result, "ok")
+
+
+class LLMJobPayloadTests(TestCase):
+    def setUp(self):
+        self.job = submit_job("prompt", location("Paris"))
+
+    def test_pending_job_is_accepted_with_poll_url(self):
+        payload, status = _llm_job_payload(self.job)
+
+        self.assertEqual(status, 202)
+        self.assertEqual(payload["poll_url"], f"/api/llm_jobs/{self.job.pk}/")
+        self.assertEqual(payload["location_context"], location("Paris"))
+
+    def test_done_job_returns_answer(self):
+        self.job.status = LLMJob.STATUS_DONE
+        self.job.result = "answer"
+
+        payload, status = _llm_job_payload(self.job)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(payload["historical_info"], "answer")
+
+    def test_failed_job_returns_error(self):
+        self.job.status = LLMJob.STATUS_FAILED
+        self.job.error = "boom"
+
+        payload, status = _llm_job_payload(self.job)
+
+        self.assertEqual(status, 500)
+        self.assertEqual(payload["error"], "boom")
+
+    def test_callers_location_context_wins(self):
+        payload, _ = _llm_job_payload(self.job, location("Paris", 120))
+
+        self.assertEqual(payload["location_context"]["area_km2"], 120)
+
+
+class TakeTokenTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        patcher = mock.patch('api.admission.timezone.now', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def take(self, **kwargs):
+        return take_token('1.2.3.4', 'geocode', rate=2, burst=3, **kwargs)
+
+    def tokens(self):
+        return ClientQuota.objects.get(client_key='1.2.3.4', endpoint_class='geocode').tokens
+
+    def test_new_bucket_starts_full(self):
+        self.assertEqual(self.take(), 0)
+        self.assertEqual(self.tokens(), 2)
+
+    def test_empty_bucket_rejects_without_taking(self):
+        for _ in range(3):
+            self.assertEqual(self.take(), 0)
+
+        self.assertAlmostEqual(self.take(), 0.5)
+        self.assertEqual(self.tokens(), 0)
+
+    def test_refill_over_time_up_to_burst(self):
+        for _ in range(3):
+            self.take()
+
+        self.now += timedelta(seconds=1)
+        self.assertEqual(self.take(), 0)
+        self.assertAlmostEqual(self.tokens(), 1)
+
+        self.now += timedelta(seconds=60)
+        self.take()
+        self.assertAlmostEqual(self.tokens(), 2)
+
+    def test_reservation_within_max_wait(self):
+        for _ in range(3):
+            self.take()
+
+        self.assertAlmostEqual(self.take(max_wait=1), 0.5)
+        # The reserved token pushes the next caller further back
+        self.assertAlmostEqual(self.tokens(), -1)
+        self.assertAlmostEqual(self.take(max_wait=0.5), 1)
+        self.assertAlmostEqual(self.tokens(), -1)
+
+    def test_cost_takes_several_tokens(self):
+        self.assertEqual(self.take(cost=3), 0)
+        self.assertAlmostEqual(self.take(cost=2), 1)
+        self.assertEqual(self.tokens(), 0)
+
+
+@override_settings(
+    ADMISSION_CONTROL_ENABLED=True,
+    ADMISSION_MAX_IN_FLIGHT_PER_CLIENT=1,
+    ADMISSION_RETRY_AFTER_SECONDS=1,
+    ADMISSION_ENDPOINT_CLASSES={
+        "geocode": {"paths": ["/api/get_region/"], "rate": 0.1, "burst": 1, "concurrency": 2},
+    },
+)
+class AdmissionControlMiddlewareTests(TestCase):
+    def get(self, path, view=None, client='10.0.0.1'):
+        middleware = AdmissionControlMiddleware(view or (lambda request: HttpResponse("ok")))
+        return middleware(RequestFactory().get(path, REMOTE_ADDR=client))
+
+    def test_admitted_request_releases_its_slot(self):
+        self.assertEqual(self.get('/api/get_region/').status_code, 200)
+        self.assertFalse(AdmissionTicket.objects.exists())
+
+    def test_over_rate_limit_is_429_with_retry_after(self):
+        self.get('/api/get_region/')
+
+        response = self.get('/api/get_region/')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_client_over_in_flight_limit_is_429(self):
+        acquire_slot('geocode', 2, client_key='10.0.0.1')
+
+        response = self.get('/api/get_region/')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_busy_class_is_503_with_retry_after(self):
+        acquire_slot('geocode', 2, client_key='10.0.0.2')
+        acquire_slot('geocode', 2, client_key='10.0.0.3')
+
+        response = self.get('/api/get_region/')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_health_check_skips_the_database(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/api/health/').status_code, 200)
+
+    def test_unlisted_path_skips_the_database(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/api/messages/').status_code, 200)
+
+    def test_slot_is_released_when_the_view_raises(self):
+        def broken_view(request):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            self.get('/api/get_region/', view=broken_view)
+
+        self.assertFalse(AdmissionTicket.objects.exists())
+
+
+class UnchangedRegionResponseTests(SimpleTestCase):
+    PLACE = {"boundingbox": ["48.8", "48.9", "2.2", "2.4"]}
+
+    def viewport(self, lat, lon, half_size=0.01):
+        return {
+            "top_left_lat": lat + half_size, "top_left_lon": lon - half_size,
+            "top_right_lat": lat + half_size, "top_right_lon": lon + half_size,
+            "bottom_left_lat": lat - half_size, "bottom_left_lon": lon - half_size,
+            "bottom_right_lat": lat - half_size, "bottom_right_lon": lon + half_size,
+        }
+
+    def token_for(self, params):
+        _, _, area_km2 = _viewport_summary(params)
+        return _region_token(self.PLACE, area_km2)
+
+    def check(self, params, **headers):
+        request = RequestFactory().get('/api/get_region/', params, **headers)
+        return _unchanged_region_response(request, request.GET)
+
+    def test_center_inside_place_is_unchanged(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        response = self.check({**self.viewport(48.87, 2.35), "region_token": token})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["unchanged"])
+        self.assertEqual(response.data["region_token"], token)
+
+    def test_center_outside_place_needs_lookup(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        self.assertIsNone(self.check({**self.viewport(49.5, 2.3), "region_token": token}))
+
+    def test_zooming_out_needs_lookup(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        self.assertIsNone(self.check({**self.viewport(48.85, 2.3, half_size=0.05), "region_token": token}))
+
+    def test_small_zoom_within_tolerance_is_unchanged(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        # 1.96x larger and 1.93x smaller than the area the token was issued for
+        for half_size in (0.014, 0.0072):
+            response = self.check({**self.viewport(48.85, 2.3, half_size=half_size), "region_token": token})
+            self.assertTrue(response.data["unchanged"])
+
+    def test_zooming_in_past_tolerance_needs_lookup(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        self.assertIsNone(self.check({**self.viewport(48.85, 2.3, half_size=0.006), "region_token": token}))
+
+    def test_bad_signature_needs_lookup(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        self.assertIsNone(self.check({**self.viewport(48.85, 2.3), "region_token": token[:-2] + "xx"}))
+
+    def test_missing_token_needs_lookup(self):
+        self.assertIsNone(self.check(self.viewport(48.85, 2.3)))
+
+    def test_if_none_match_returns_304(self):
+        token = self.token_for(self.viewport(48.85, 2.3))
+
+        response = self.check(self.viewport(48.86, 2.31), HTTP_IF_NONE_MATCH=f'"{token}"')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], f'"{token}"')
@@ -11,6 +11,8 @@ urlpatterns = [
     path('get_region/', views.get_region, name="get_region"),
     path('historical_prompt/', views.generate_historical_prompt, name="generate_historical_prompt"),
     path('ask_gemini/', views.ask_gemini_about_region, name="ask_gemini_about_region"),
+    path('ask_gemini/batch/', views.ask_gemini_batch, name="ask_gemini_batch"),
+    path('llm_jobs/<int:job_id>/', views.llm_job_status, name="llm_job_status"),
     path('list_gemini_models/', views.list_gemini_models, name="list_gemini_models"),
     path('', include(router.urls))
 ]
\ No newline at end of file
@@ -1,14 +1,28 @@
 from rest_framework import viewsets
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Message
+from .models import LLMJob, Message
 from .serializers import MessageSerializer
+from . import admission, llm_queue
 
 import requests
 import math
 from django.http import JsonResponse
 import google.generativeai as genai
 import os
+import time
+from django.conf import settings
+from django.core import signing
+
+REGION_TOKEN_SALT = "api.region_token"
+# A region token still applies while the viewport area stays within this factor
+# of the area it was issued for
+REGION_AREA_TOLERANCE = 2
+# Nominatim reverse zoom for a viewport, by its area in km² (first match wins):
+# street, neighbourhood, city, county, state, then country level. The resolved
+# place, and the bounding box in its region token, then match what is on screen
+NOMINATIM_ZOOM_BY_AREA = [(1, 17), (25, 14), (2500, 10), (250000, 8), (2500000, 5)]
+NOMINATIM_COUNTRY_ZOOM = 3
 
 @api_view(['GET'])
 def health_check(request):
@@ -33,7 +47,7 @@ def geocode_search(request):
     params = {"format": "json", "q": query, "limit": 5}  # limit to 5 results
     headers = {"User-Agent": "django-geocoder"}
 
-    response = requests.get(url, params=params, headers=headers)
+    response = requests.get(url, params=params, headers=headers, timeout=settings.NOMINATIM_TIMEOUT)
     data = response.json()
 
     if not data:
@@ -58,6 +72,11 @@ def geocode_search(request):
 
 @api_view(["GET"])
 def get_region(request):
+    # Skip Nominatim entirely if the client's previous place still contains the view
+    unchanged = _unchanged_region_response(request, request.GET)
+    if unchanged:
+        return unchanged
+    
     # Accept either the old single-point format or new 4-corner format
     lat = request.GET.get("lat")
     lon = request.GET.get("lon")
@@ -103,19 +122,6 @@ def get_region(request):
                 'west': min(all_lons)
             }
             
-            # Get region information using the center point
-            r = requests.get(
-                "https://nominatim.openstreetmap.org/reverse",
-                params={"format": "json", "lat": center_lat, "lon": center_lon},
-                headers={"User-Agent": "django-geocoder"}
-            )
-            r.raise_for_status()
-            data = r.json()
-            
-            # Get the address components for a more detailed description
-            address = data.get("address", {})
-            display_name = data.get("display_name", f"{center_lat:.3f}, {center_lon:.3f}")
-            
             # Calculate approximate area in square kilometers
             # Rough approximation using the haversine formula for small areas
             lat_diff = bbox['north'] - bbox['south']
@@ -126,6 +132,21 @@ def get_region(request):
             lon_km = lon_diff * 111 * abs(math.cos(math.radians(center_lat)))
             area_km2 = lat_km * lon_km
             
+            # Get region information using the center point, at a detail level
+            # that suits the viewport size
+            r = requests.get(
+                "https://nominatim.openstreetmap.org/reverse",
+                params={"format": "json", "lat": center_lat, "lon": center_lon, "zoom": _nominatim_zoom_for_area(area_km2)},
+                headers={"User-Agent": "django-geocoder"},
+                timeout=settings.NOMINATIM_TIMEOUT
+            )
+            r.raise_for_status()
+            data = r.json()
+            
+            # Get the address components for a more detailed description
+            address = data.get("address", {})
+            display_name = data.get("display_name", f"{center_lat:.3f}, {center_lon:.3f}")
+            
             # Build a comprehensive region description
             region_parts = []
             
@@ -151,13 +172,15 @@ def get_region(request):
             
             region_description += area_str
             
-            return Response({
+            region_token = _region_token(data, area_km2)
+            return _with_region_etag(Response({
                 "region": region_description,
                 "center": {"lat": center_lat, "lon": center_lon},
                 "bounding_box": bbox,
                 "area_km2": area_km2,
-                "address_components": address
-            })
+                "address_components": address,
+                "region_token": region_token
+            }), region_token)
             
         except (ValueError, TypeError) as e:
             return Response({"error": f"Invalid coordinate values: {str(e)}"}, status=400)
@@ -170,7 +193,8 @@ def get_region(request):
             r = requests.get(
                 "https://nominatim.openstreetmap.org/reverse",
                 params={"format": "json", "lat": lat, "lon": lon},
-                headers={"User-Agent": "django-geocoder"}
+                headers={"User-Agent": "django-geocoder"},
+                timeout=settings.NOMINATIM_TIMEOUT
             )
             r.raise_for_status()
             data = r.json()
@@ -185,11 +209,123 @@ def get_region(request):
             "error": "Missing coordinates. Provide either 'lat' & 'lon' or all 8 corner coordinates (top_left_lat, top_left_lon, etc.)"
         }, status=400)
 
+def _nominatim_zoom_for_area(area_km2):
+    """
+    Helper function to pick the Nominatim reverse zoom for a viewport area
+    """
+    for max_area_km2, zoom in NOMINATIM_ZOOM_BY_AREA:
+        if area_km2 < max_area_km2:
+            return zoom
+    return NOMINATIM_COUNTRY_ZOOM
+
+def _region_token(location_data, area_km2):
+    """
+    Helper function to build a signed token for the place Nominatim resolved.
+    The token carries the place's bounding box and the viewport's area,
+    so later requests can tell whether the view moved out of the place or
+    zoomed noticeably without another upstream call.
+    Returns None if Nominatim gave no bounding box.
+    """
+    try:
+        south, north, west, east = [float(coord) for coord in location_data["boundingbox"]]
+    except (KeyError, TypeError, ValueError):
+        return None
+    
+    return signing.dumps(
+        {"bbox": [south, north, west, east], "area_km2": area_km2},
+        salt=REGION_TOKEN_SALT
+    )
+
+def _similar_area(area_km2, token_area_km2):
+    """
+    Helper function to tell whether two viewport areas are within
+    REGION_AREA_TOLERANCE of each other
+    """
+    if area_km2 <= 0 or token_area_km2 <= 0:
+        return False
+    return max(area_km2, token_area_km2) / min(area_km2, token_area_km2) <= REGION_AREA_TOLERANCE
+
+def _with_region_etag(response, region_token):
+    """
+    Helper function to expose the region token as the response ETag
+    """
+    if region_token:
+        response["ETag"] = f'"{region_token}"'
+    return response
+
+def _unchanged_region_response(request, params):
+    """
+    Helper function for viewport-change requests. If the client sends the
+    previous response's token (`region_token` param or If-None-Match), the new
+    viewport center is still inside that place and the viewport area is within
+    REGION_AREA_TOLERANCE of the token's, returns a tiny "unchanged" reply (304 for If-None-Match).
+    Otherwise returns None and the caller does the full lookup.
+    """
+    region_token = params.get("region_token")
+    from_etag = False
+    if not region_token:
+        region_token = request.headers.get("If-None-Match", "").strip().removeprefix("W/").strip('"')
+        from_etag = True
+    if not region_token:
+        return None
+    
+    try:
+        place = signing.loads(region_token, salt=REGION_TOKEN_SALT)
+        south, north, west, east = place["bbox"]
+        token_area_km2 = float(place["area_km2"])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+    
+    viewport = _viewport_summary(params)
+    if viewport is None:
+        return None
+    center_lat, center_lon, area_km2 = viewport
+    
+    if not (south <= center_lat <= north and west <= center_lon <= east):
+        return None
+    
+    if not _similar_area(area_km2, token_area_km2):
+        return None
+    
+    if from_etag:
+        return _with_region_etag(Response(status=304), region_token)
+    
+    return _with_region_etag(Response({
+        "unchanged": True,
+        "region_token": region_token,
+        "center": {"lat": center_lat, "lon": center_lon}
+    }), region_token)
+
+def _viewport_summary(params):
+    """
+    Helper function to get the viewport center and area from the 8 corner
+    coordinates. Returns (center_lat, center_lon, area_km2), or None if the
+    corners are missing or invalid
+    """
+    corner_names = ["top_left", "top_right", "bottom_left", "bottom_right"]
+    try:
+        lats = [float(params.get(f"{name}_lat")) for name in corner_names]
+        lons = [float(params.get(f"{name}_lon")) for name in corner_names]
+    except (ValueError, TypeError):
+        return None
+    
+    center_lat = sum(lats) / 4
+    center_lon = sum(lons) / 4
+    
+    # Same approximation as get_region
+    lat_km = (max(lats) - min(lats)) * 111
+    lon_km = (max(lons) - min(lons)) * 111 * abs(math.cos(math.radians(center_lat)))
+    return center_lat, center_lon, lat_km * lon_km
+
 @api_view(["GET"])
 def generate_historical_prompt(request):
     """
     Generate an LLM prompt for historical events and landmarks based on viewport coordinates
     """
+    unchanged = _unchanged_region_response(request, request.GET)
+    if unchanged:
+        return unchanged
+    
     # Generate the prompt using our helper function
     prompt_text, location_context, error = _generate_prompt_data(request)
     
@@ -199,30 +335,40 @@ def generate_historical_prompt(request):
     if not prompt_text:
         return Response({"error": "Failed to generate prompt"}, status=500)
     
-    return Response({
+    return _with_region_etag(Response({
         "prompt": prompt_text,
         "location_context": location_context,
         "prompt_length": len(prompt_text)
-    })
+    }), location_context.get("region_token"))
 
 def _generate_prompt_data(request):
     """
     Helper function to generate prompt data from request parameters.
     Returns a tuple of (prompt_text, location_context, error_response)
     """
+    return _generate_prompt_data_from_params(request.GET)
+
+def _generate_prompt_data_from_params(params, timeout=None):
+    """
+    Same as _generate_prompt_data, for any mapping of coordinate parameters
+    (query string or one region of a batch request body).
+    timeout overrides settings.NOMINATIM_TIMEOUT for the reverse lookup.
+    """
+    timeout = timeout or settings.NOMINATIM_TIMEOUT
+    
     # Get the same coordinate parameters as other functions
-    lat = request.GET.get("lat")
-    lon = request.GET.get("lon")
+    lat = params.get("lat")
+    lon = params.get("lon")
     
     # New 4-corner format parameters
-    top_left_lat = request.GET.get("top_left_lat")
-    top_left_lon = request.GET.get("top_left_lon")
-    top_right_lat = request.GET.get("top_right_lat")
-    top_right_lon = request.GET.get("top_right_lon")
-    bottom_left_lat = request.GET.get("bottom_left_lat")
-    bottom_left_lon = request.GET.get("bottom_left_lon")
-    bottom_right_lat = request.GET.get("bottom_right_lat")
-    bottom_right_lon = request.GET.get("bottom_right_lon")
+    top_left_lat = params.get("top_left_lat")
+    top_left_lon = params.get("top_left_lon")
+    top_right_lat = params.get("top_right_lat")
+    top_right_lon = params.get("top_right_lon")
+    bottom_left_lat = params.get("bottom_left_lat")
+    bottom_left_lon = params.get("bottom_left_lon")
+    bottom_right_lat = params.get("bottom_right_lat")
+    bottom_right_lon = params.get("bottom_right_lon")
 
     # Check if we have the new 4-corner format
     corner_params = [top_left_lat, top_left_lon, top_right_lat, top_right_lon, 
@@ -265,16 +411,19 @@ def _generate_prompt_data(request):
             try:
                 r = requests.get(
                     "https://nominatim.openstreetmap.org/reverse",
-                    params={"format": "json", "lat": center_lat, "lon": center_lon},
-                    headers={"User-Agent": "django-geocoder"}
+                    params={"format": "json", "lat": center_lat, "lon": center_lon, "zoom": _nominatim_zoom_for_area(area_km2)},
+                    headers={"User-Agent": "django-geocoder"},
+                    timeout=timeout
                 )
                 r.raise_for_status()
                 location_data = r.json()
                 address = location_data.get("address", {})
                 location_name = location_data.get("display_name", f"{center_lat:.3f}, {center_lon:.3f}")
+                region_token = _region_token(location_data, area_km2)
             except:
                 address = {}
                 location_name = f"{center_lat:.3f}, {center_lon:.3f}"
+                region_token = None
             
             # Build comprehensive LLM prompt
             prompt = f"""You are a knowledgeable historian and geographer. I am viewing a specific region on Earth through a 3D globe interface. Please provide me with interesting historical events, landmarks, and cultural significance for this area.
@@ -321,7 +470,8 @@ Keep each bullet point to 1 short sentence. Be very concise."""
                 "bounding_box": bbox,
                 "area_km2": area_km2,
                 "location_name": location_name,
-                "address_components": address
+                "address_components": address,
+                "region_token": region_token
             }
             
             return prompt, location_context, None
@@ -336,7 +486,8 @@ Keep each bullet point to 1 short sentence. Be very concise."""
             r = requests.get(
                 "https://nominatim.openstreetmap.org/reverse",
                 params={"format": "json", "lat": lat, "lon": lon},
-                headers={"User-Agent": "django-geocoder"}
+                headers={"User-Agent": "django-geocoder"},
+                timeout=timeout
             )
             r.raise_for_status()
             location_data = r.json()
@@ -378,15 +529,20 @@ Keep each bullet point to 1 short sentence. Be very concise."""
 @api_view(["GET"])
 def ask_gemini_about_region(request):
     """
-    Generate historical information using Gemini AI based on viewport coordinates
+    Queue a Gemini request for historical information about the viewport.
+    Answers with the result if an identical job already finished, otherwise
+    with 202 and a job id to poll via /api/llm_jobs/<id>/
     """
-    # Configure Gemini API
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
+    if not os.getenv('GEMINI_API_KEY'):
         return Response({
             "error": "Gemini API key not configured. Please set GEMINI_API_KEY environment variable."
         }, status=500)
     
+    # The previous answer still applies if the view stayed within the same place
+    unchanged = _unchanged_region_response(request, request.GET)
+    if unchanged:
+        return unchanged
+    
     # Generate the prompt using our helper function
     prompt_text, location_context, error = _generate_prompt_data(request)
     
@@ -396,45 +552,154 @@ def ask_gemini_about_region(request):
     if not prompt_text:
         return Response({"error": "Failed to generate prompt"}, status=500)
     
-    try:
-        genai.configure(api_key=api_key)
-        
-        # Use only Gemini 1.5 Flash for concise responses
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Create a concise version of the prompt
-        concise_prompt = f"""Location: {location_context['location_name']}
-Area: ~{location_context.get('area_km2', 0):.1f} km²
-
-Give me exactly 2-3 bullet points for each:
-
-**Historical Events:**
-(Most significant events with dates)
-
-**Landmarks:**
-(Famous places or monuments)
+    # Pre-warm jobs are only processed when no interactive work is queued
+    if request.GET.get("priority") == "prewarm":
+        priority = LLMJob.PRIORITY_PREWARM
+    else:
+        priority = LLMJob.PRIORITY_INTERACTIVE
+    
+    # Create a concise version of the prompt
+    concise_prompt = llm_queue.build_concise_prompt(location_context)
+    job = llm_queue.submit_job(concise_prompt, location_context, priority)
+    
+    # A deduplicated job may have been queued for another viewport; report ours
+    payload, status = _llm_job_payload(job, location_context)
+    return Response(payload, status=status)
 
-**Notable Facts:**
-(Interesting tidbits about this area)
+@api_view(["GET"])
+def llm_job_status(request, job_id):
+    """
+    Poll a queued Gemini job. Never waits, so polling can't tie up web workers
+    """
+    try:
+        job = LLMJob.objects.get(pk=job_id)
+    except LLMJob.DoesNotExist:
+        return Response({"error": "Job not found."}, status=404)
+    
+    payload, status = _llm_job_payload(job)
+    return Response(payload, status=status)
 
-Keep each bullet point to 1 short sentence. Be very concise."""
-        
-        # Generate response with concise prompt
-        response = model.generate_content(concise_prompt)
-        
+@api_view(["POST"])
+def ask_gemini_batch(request):
+    """
+    Queue Gemini requests for several regions at once. Workers pack jobs
+    submitted together into a single Gemini call.
+    Body: {"regions": [{"id": ..., <lat/lon or 8 corner params>}, ...], "priority": ...}
+    """
+    if not os.getenv('GEMINI_API_KEY'):
         return Response({
-            "historical_info": response.text,
-            "location_context": location_context,
-            "original_prompt": concise_prompt,
-            "model_used": "gemini-2.5-flash"
-        })
-        
-    except Exception as e:
+            "error": "Gemini API key not configured. Please set GEMINI_API_KEY environment variable."
+        }, status=500)
+    
+    # A JSON body can be any value; only an object carries "regions"
+    if not isinstance(request.data, dict):
+        return Response({"error": "Request body must be a JSON object."}, status=400)
+    
+    regions = request.data.get("regions")
+    if not isinstance(regions, list) or not regions:
+        return Response({"error": "Provide a non-empty 'regions' list."}, status=400)
+    
+    if len(regions) > settings.LLM_BATCH_MAX_REGIONS:
         return Response({
-            "error": f"Failed to get response from Gemini: {str(e)}",
-            "original_prompt": prompt_text,
+            "error": f"Too many regions; at most {settings.LLM_BATCH_MAX_REGIONS} per batch."
+        }, status=400)
+    
+    if request.data.get("priority") == "prewarm":
+        priority = LLMJob.PRIORITY_PREWARM
+    else:
+        priority = LLMJob.PRIORITY_INTERACTIVE
+    
+    # Results are keyed by str(id), so ids must stay distinct after conversion
+    region_ids = set()
+    for index, region in enumerate(regions):
+        if not isinstance(region, dict):
+            return Response({"error": f"Region {index} must be an object."}, status=400)
+        
+        region_id = str(region.get("id", index))
+        if region_id in region_ids:
+            return Response({"error": f"Duplicate region id '{region_id}'."}, status=400)
+        region_ids.add(region_id)
+    
+    # Every region costs a Nominatim lookup, so the batch is admitted against
+    # the geocode quota once per region, on top of the llm admission it already passed
+    geocode_ticket = None
+    if settings.ADMISSION_CONTROL_ENABLED:
+        geocode_ticket, rejection = admission.admit(
+            admission.client_key(request), "geocode", cost=len(regions)
+        )
+        if rejection:
+            return rejection
+    
+    # Build every prompt before queueing anything, so a bad region rejects the whole batch.
+    # The lookups run one after another, so they share one deadline that keeps
+    # the request well inside the gunicorn worker timeout
+    deadline = time.monotonic() + settings.LLM_BATCH_GEOCODE_DEADLINE_SECONDS
+    prompts = []
+    try:
+        for index, region in enumerate(regions):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return Response({
+                    "region_id": region.get("id", index),
+                    "error": "Timed out looking up regions; try fewer regions per batch."
+                }, status=504)
+            
+            prompt_text, location_context, error = _generate_prompt_data_from_params(
+                region, timeout=min(settings.NOMINATIM_TIMEOUT, remaining)
+            )
+            if error:
+                return Response(
+                    {"region_id": region.get("id", index), **error},
+                    status=error.get('status', 500)
+                )
+            prompts.append((region.get("id", index), location_context))
+    finally:
+        if geocode_ticket:
+            admission.release_slot(geocode_ticket)
+    
+    results = {}
+    for region_id, location_context in prompts:
+        job = llm_queue.submit_job(
+            llm_queue.build_concise_prompt(location_context), location_context, priority
+        )
+        payload, _ = _llm_job_payload(job, location_context)
+        results[str(region_id)] = payload
+    
+    return Response({"results": results})
+
+def _llm_job_payload(job, location_context=None):
+    """
+    Helper function to describe a job, using the caller's location_context
+    when given (the job's own otherwise).
+    Returns a tuple of (response_data, http_status)
+    """
+    location_context = location_context or job.location_context
+    
+    if job.status == LLMJob.STATUS_DONE:
+        return {
+            "job_id": job.pk,
+            "status": job.status,
+            "historical_info": job.result,
+            "location_context": location_context,
+            "original_prompt": job.prompt,
+            "model_used": llm_queue.GEMINI_MODEL
+        }, 200
+    
+    if job.status == LLMJob.STATUS_FAILED:
+        return {
+            "job_id": job.pk,
+            "status": job.status,
+            "error": job.error,
+            "original_prompt": job.prompt,
             "location_context": location_context
-        }, status=500)
+        }, 500
+    
+    return {
+        "job_id": job.pk,
+        "status": job.status,
+        "location_context": location_context,
+        "poll_url": f"/api/llm_jobs/{job.pk}/"
+    }, 202
 
 @api_view(["GET"])
 def list_gemini_models(request):
@@ -41,6 +41,7 @@ fi
 # Start Gunicorn
 exec gunicorn mysite.wsgi:application \
   --bind 0.0.0.0:8000 \
-  --workers 3 \
+  --workers ${GUNICORN_WORKERS:-5} \
+  --timeout ${GUNICORN_TIMEOUT:-30} \
   --log-level info
 
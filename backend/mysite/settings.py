@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -137,5 +138,76 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [],
 }
 
+# LLM job queue settings
+LLM_WORKER_COUNT = int(os.getenv("LLM_WORKER_COUNT", 4))
+# Seconds an idle worker waits between polls of the job table
+LLM_JOB_POLL_INTERVAL = float(os.getenv("LLM_JOB_POLL_INTERVAL", 0.25))
+# Finished results are reused for identical regions within this window
+LLM_JOB_RESULT_TTL_SECONDS = int(os.getenv("LLM_JOB_RESULT_TTL_SECONDS", 3600))
+# Running jobs older than this are assumed orphaned and requeued
+LLM_JOB_STALE_SECONDS = int(os.getenv("LLM_JOB_STALE_SECONDS", 120))
+# Per-call Gemini timeout; must stay below LLM_JOB_STALE_SECONDS
+LLM_GEMINI_TIMEOUT_SECONDS = int(os.getenv("LLM_GEMINI_TIMEOUT_SECONDS", 60))
+# A job is retried (after a stale worker or a missing batch answer) until it has
+# been claimed this many times
+LLM_JOB_MAX_ATTEMPTS = int(os.getenv("LLM_JOB_MAX_ATTEMPTS", 3))
+# Back-off for LLM workers after a database or unexpected error
+LLM_WORKER_RETRY_SECONDS = int(os.getenv("LLM_WORKER_RETRY_SECONDS", 5))
+# Up to LLM_BATCH_SIZE queued regions are packed into one Gemini call; a partial
+# batch is held for up to LLM_BATCH_WINDOW_SECONDS to let more requests join
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 8))
+LLM_BATCH_WINDOW_SECONDS = float(os.getenv("LLM_BATCH_WINDOW_SECONDS", 0.3))
+# Most regions accepted by /api/ask_gemini/batch/ in one request. Each region is a
+# Nominatim lookup inside the request and costs one geocode token, so keep this
+# small and no larger than ADMISSION_GEOCODE_BURST
+LLM_BATCH_MAX_REGIONS = int(os.getenv("LLM_BATCH_MAX_REGIONS", 5))
+
+# Seconds before an upstream Nominatim request is abandoned
+NOMINATIM_TIMEOUT = float(os.getenv("NOMINATIM_TIMEOUT", 5))
+# Total time /api/ask_gemini/batch/ may spend on its Nominatim lookups; keep it
+# well below the gunicorn worker timeout (30s) so the request can't be killed mid-batch
+LLM_BATCH_GEOCODE_DEADLINE_SECONDS = float(os.getenv("LLM_BATCH_GEOCODE_DEADLINE_SECONDS", 15))
+
+# Admission control (api.middleware.AdmissionControlMiddleware)
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "True").lower() in ("1", "true", "yes")
+# Never rate limited and never touch the database
+ADMISSION_FAST_PATHS = ["/api/health/"]
+# Must match the gunicorn flags in entrypoint.sh, which reads the same variables
+GUNICORN_WORKERS = int(os.getenv("GUNICORN_WORKERS", 5))
+GUNICORN_TIMEOUT = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# Path prefixes grouped by cost: per-client token bucket (rate in requests/second,
+# burst capacity) plus a cap on requests in flight across all web workers.
+# Admitted requests, including ones briefly waiting for a token, count against the
+# caps. Keep the sum of all caps below GUNICORN_WORKERS so cheap endpoints such as
+# /api/health/ always find a free worker.
+ADMISSION_ENDPOINT_CLASSES = {
+    "llm": {
+        "paths": ["/api/ask_gemini/", "/api/list_gemini_models/"],
+        "rate": float(os.getenv("ADMISSION_LLM_RATE", 0.5)),
+        "burst": int(os.getenv("ADMISSION_LLM_BURST", 5)),
+        "concurrency": int(os.getenv("ADMISSION_LLM_CONCURRENCY", 2)),
+    },
+    "geocode": {
+        "paths": ["/api/get_region/", "/api/search/", "/api/historical_prompt/"],
+        "rate": float(os.getenv("ADMISSION_GEOCODE_RATE", 2)),
+        "burst": int(os.getenv("ADMISSION_GEOCODE_BURST", 10)),
+        "concurrency": int(os.getenv("ADMISSION_GEOCODE_CONCURRENCY", 2)),
+    },
+}
+# A client whose next token is due within this many seconds waits (holding its
+# concurrency slot) instead of being rejected; keep it well under a request's cost
+ADMISSION_MAX_QUEUE_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_SECONDS", 0.25))
+# In-flight requests one client may hold per endpoint class; keep it below the
+# class concurrency so a single client can never take every slot
+ADMISSION_MAX_IN_FLIGHT_PER_CLIENT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT_PER_CLIENT", 1))
+ADMISSION_RETRY_AFTER_SECONDS = 1
+# In-flight tickets older than this are assumed leaked by a killed worker. Gunicorn
+# kills a request after GUNICORN_TIMEOUT, so no live request holds a ticket longer
+ADMISSION_TICKET_STALE_SECONDS = GUNICORN_TIMEOUT
+# How often each web worker deletes token buckets that have been idle long enough to refill
+ADMISSION_QUOTA_PRUNE_SECONDS = 300
+# Only enable behind a reverse proxy that sets X-Forwarded-For
+ADMISSION_TRUST_X_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_X_FORWARDED_FOR", "False").lower() in ("1", "true", "yes")
+
 # dev only 
 CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
@@ -40,6 +40,9 @@ const MAX_LEVEL_3857 = 9;
 const BASE_ALPHA = 0.9; // default base map underneath
 const GIBS_ALPHA = 0.8;  // GIBS overlay on top
 
+const GEMINI_POLL_INTERVAL_MS = 1000;
+const GEMINI_POLL_TIMEOUT_MS = 60000; // give up on a queued Gemini job after a minute
+
 function buildGibsProvider3857(layerId: string, time: string, format: "jpg" | "png") {
   const tilingScheme = new WebMercatorTilingScheme();
   const url = `https://gibs.earthdata.nasa.gov/wmts/epsg3857/best/${layerId}/default/{Time}/{TileMatrixSet}/{TileMatrix}/{TileRow}/{TileCol}.${format}`;
@@ -71,6 +74,14 @@ const Globe: React.FC<GlobeProps> = ({
   const [region, setRegion] = useState<string | null>(null);
   const [geminiResponse, setGeminiResponse] = useState<string | null>(null);
   const [loadingGemini, setLoadingGemini] = useState(false);
+  // Last Gemini answer and the region token of the place it describes
+  const lastGeminiRef = useRef<{ regionToken: string; info: string } | null>(null);
+  // Cancels the in-flight Gemini request when a new one starts or on unmount
+  const geminiAbortRef = useRef<AbortController | null>(null);
+
+  useEffect(() => {
+    return () => geminiAbortRef.current?.abort();
+  }, []);
 
 
   // keep layer refs
@@ -387,6 +398,10 @@ const Globe: React.FC<GlobeProps> = ({
       return;
     }
 
+    geminiAbortRef.current?.abort();
+    const controller = new AbortController();
+    geminiAbortRef.current = controller;
+
     setLoadingGemini(true);
 
     // Build URL with all 4 corner coordinates (same as other functions)
@@ -400,20 +415,49 @@ const Globe: React.FC<GlobeProps> = ({
       bottom_right_lat: viewportBounds.bottomRight.lat.toString(),
       bottom_right_lon: viewportBounds.bottomRight.lon.toString(),
     });
+    // Lets the backend skip the request if the view is still in the same place
+    if (lastGeminiRef.current) {
+      params.set("region_token", lastGeminiRef.current.regionToken);
+    }
 
-    try {
-      const response = await fetch(`/api/ask_gemini/?${params}`);
+    const fetchJson = async (url: string) => {
+      const response = await fetch(url, { signal: controller.signal });
       const text = await response.text();
-      let data;
       try {
-        data = JSON.parse(text);
+        return { status: response.status, data: JSON.parse(text), text };
       } catch {
-        setGeminiResponse("Failed to parse backend response: " + text);
+        return { status: response.status, data: null, text };
+      }
+    };
+
+    try {
+      let result = await fetchJson(`/api/ask_gemini/?${params}`);
+      // The first reply describes our viewport; a shared job's later replies may not
+      const regionToken = result.data?.location_context?.region_token;
+
+      // The request was queued; poll the job until a worker finishes it or we give up
+      const deadline = Date.now() + GEMINI_POLL_TIMEOUT_MS;
+      while (result.status === 202 && result.data?.poll_url) {
+        if (Date.now() >= deadline) {
+          setGeminiResponse("Gemini is taking longer than expected. Please try again in a moment.");
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, GEMINI_POLL_INTERVAL_MS));
+        if (controller.signal.aborted) return;
+        result = await fetchJson(result.data.poll_url);
+      }
+
+      const data = result.data;
+      if (!data) {
+        setGeminiResponse("Failed to parse backend response: " + result.text);
         return;
       }
 
-      if (data.historical_info) {
+      if (data.unchanged && lastGeminiRef.current) {
+        setGeminiResponse(lastGeminiRef.current.info);
+      } else if (data.historical_info) {
         setGeminiResponse(data.historical_info);
+        lastGeminiRef.current = regionToken ? { regionToken, info: data.historical_info } : null;
         console.log("Gemini response received from:", data.model_used);
         console.log("Location context:", data.location_context);
       } else if (data.error) {
@@ -422,9 +466,14 @@ const Globe: React.FC<GlobeProps> = ({
         setGeminiResponse("No response received from Gemini");
       }
     } catch (err) {
+      if (controller.signal.aborted) return;
       setGeminiResponse("Failed to get response from Gemini: " + err);
     } finally {
-      setLoadingGemini(false);
+      // A newer question owns the loading state once this one is cancelled
+      if (geminiAbortRef.current === controller) {
+        geminiAbortRef.current = null;
+        setLoadingGemini(false);
+      }
     }
   };
 